@@ -1,4 +1,6 @@
 # Este archivo hace que la carpeta app sea reconocida como un paquete Python
+from functools import lru_cache
+
 # Versión del proyecto
 VERSION = "0.1.0"
 
@@ -7,16 +9,38 @@ VERSION = "0.1.0"
 
 # Funciones para lazy loading de componentes
 def get_settings():
-    from app.core.config import settings
-    return settings
+    from app.core.config import get_settings as _get_settings
+    return _get_settings()
 
+@lru_cache(maxsize=1)
 def get_users_helper():
     from app.helpers.users_helper import UsersHelper
-    return UsersHelper()
+    settings = get_settings()
+    return UsersHelper(
+        supabase_url=settings.SUPABASE_URL,
+        supabase_key=settings.SUPABASE_KEY,
+        jwt_secret=settings.JWT_SECRET,
+        access_token_expire_minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+        bcrypt_rounds=settings.BCRYPT_ROUNDS
+    )
+
+# Namespaces por dominio, importados bajo demanda (PEP 562) para no cargar
+# httpx, bcrypt, jwt, supabase, etc. al hacer `import app`
+_LAZY = {
+    "user": "app.models.user",
+    "auth": "app.routers.auth"
+}
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        module = importlib.import_module(_LAZY[name])
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Namespaces por dominio
-from app.models import user
-from app.routers import auth
+def __dir__():
+    return list(globals()) + list(_LAZY)
 
 # Exportación reducida a los módulos/namespaces en lugar de clases individuales
 __all__ = [
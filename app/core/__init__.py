@@ -1,5 +1,11 @@
 # Este archivo hace que la carpeta core sea reconocida como un paquete Python
-from app.core.config import settings
+from app.core.config import get_settings
+
+def __getattr__(name):
+    # Compatibilidad con `from app.core import settings` (PEP 562)
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Exportar los módulos relevantes
-__all__ = ["settings"]
\ No newline at end of file
+__all__ = ["settings", "get_settings"]
\ No newline at end of file
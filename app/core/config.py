@@ -1,8 +1,13 @@
-import os
 from dotenv import load_dotenv
+import atexit
 import logging
+import logging.handlers
+import queue
 from pathlib import Path
 import sys
+from functools import lru_cache
+from typing import List, Optional
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 # Cargar variables de entorno
 load_dotenv()
@@ -13,43 +18,70 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 # Configurar el logging
 log_handlers = [logging.StreamHandler()]
 
-# Intentar crear el directorio de logs y añadir el FileHandler si es posible
+# Intentar crear el directorio de logs y añadir el RotatingFileHandler si es posible
 logs_dir = BASE_DIR / "logs"
 try:
     if not logs_dir.exists():
         logs_dir.mkdir(parents=True, exist_ok=True)
     
     log_file = logs_dir / "app.log"
-    log_handlers.append(logging.FileHandler(log_file))
+    log_handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5))
 except (OSError, PermissionError) as e:
     # Si no podemos crear el directorio o archivo, solo usamos la consola
     print(f"No se pudo crear el directorio/archivo de logs: {e}", file=sys.stderr)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=log_handlers
-)
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+# Los registros se encolan y un hilo aparte los escribe en consola y fichero,
+# para que las escrituras a disco no bloqueen el event loop
+log_queue = queue.Queue(-1)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 logger = logging.getLogger(__name__)
 
 # Configuración de la aplicación
-class Settings:
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore", frozen=True)
+    
     PROJECT_NAME: str = "Proyecto Horizon API"
     PROJECT_VERSION: str = "0.1.0"
     PROJECT_DESCRIPTION: str = "API para la autenticación de usuarios"
     
     # Configuración de Supabase
-    SUPABASE_URL: str = os.getenv("SUPABASE_URL")
-    SUPABASE_KEY: str = os.getenv("SUPABASE_KEY")
+    SUPABASE_URL: Optional[str] = None
+    SUPABASE_KEY: Optional[str] = None
     
     # Configuración JWT
-    JWT_SECRET: str = os.getenv("JWT_SECRET")
+    JWT_SECRET: Optional[str] = None
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24  # 1 día
     
-    # Configuración CORS
-    CORS_ORIGINS: list = os.getenv("ALLOWED_ORIGINS", "*").split(",")
+    # Coste de bcrypt para los hashes nuevos
+    BCRYPT_ROUNDS: int = 12
+    
+    # Configuración CORS (orígenes separados por comas)
+    ALLOWED_ORIGINS: str = "*"
+    
+    @property
+    def CORS_ORIGINS(self) -> List[str]:
+        return [origin.strip() for origin in self.ALLOWED_ORIGINS.split(",") if origin.strip()]
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Devuelve la instancia única de la configuración."""
+    return Settings()
 
-# Crear una instancia de las configuraciones
-settings = Settings()
\ No newline at end of file
+def __getattr__(name):
+    # Compatibilidad con `from app.core.config import settings`: se resuelve
+    # bajo demanda con la misma instancia que get_settings()
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
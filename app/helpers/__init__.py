@@ -1,5 +1,21 @@
 # Este archivo hace que la carpeta helpers sea reconocida como un paquete Python
-from app.helpers.users_helper import UsersHelper
+# Los helpers se importan bajo demanda (PEP 562) para que importar un helper
+# no cargue las dependencias de los demás
+
+_LAZY = {
+    "UsersHelper": "app.helpers.users_helper"
+}
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return list(globals()) + list(_LAZY)
 
 # Exportar las clases helper relevantes
-__all__ = ["UsersHelper"]
\ No newline at end of file
+__all__ = ["UsersHelper"]
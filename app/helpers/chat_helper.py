@@ -1,31 +1,101 @@
+import asyncio
 import logging
 import uuid
 import aiohttp
+import httpx
+import orjson
 from datetime import datetime
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from fastapi import BackgroundTasks
 
 from app.models.chat import (
     Conversation, ConversationCreate, 
     Message, MessageCreate,
     ConversationWithFirstMessage
 )
-from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+class ConversationNotFoundError(LookupError):
+    """La conversación no existe o no pertenece al usuario."""
+
+def _utc_now_iso() -> str:
+    """Devuelve la hora actual en UTC en formato ISO 8601."""
+    return datetime.utcnow().isoformat() + "Z"
+
+def _replace_postgrest_session(client) -> None:
+    """
+    Sustituye la sesión HTTP de postgrest-py por una con un pool acotado y
+    keep-alive compartido por todas las peticiones (postgrest-py crea la suya
+    sin límites explícitos).
+    """
+    from postgrest.utils import SyncClient
+    session = client.postgrest.session
+    # SyncClient es un httpx.Client con el aclose() que usa SyncPostgrestClient
+    client.postgrest.session = SyncClient(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=session.timeout,
+        http2=True,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30.0)
+    )
+    session.close()
+
+@lru_cache(maxsize=1)
+def _get_supabase_client(supabase_url: str, supabase_key: str):
+    """Devuelve un cliente Supabase único por par URL/clave."""
+    import supabase
+    client = supabase.create_client(supabase_url, supabase_key)
+    _replace_postgrest_session(client)
+    return client
+
 class ChatHelper:
     def __init__(self, supabase_url: str, supabase_key: str):
         """Inicializa el helper con la configuración de Supabase."""
-        import supabase
-        self.supabase = supabase.create_client(supabase_url, supabase_key)
+        self.supabase = _get_supabase_client(supabase_url, supabase_key)
+        # Sesión HTTP compartida para el webhook de n8n (se crea bajo demanda)
+        self._session: Optional[aiohttp.ClientSession] = None
         logger.info("ChatHelper inicializado con cliente Supabase")
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Devuelve la sesión HTTP compartida, creándola si no existe o está cerrada."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=100,
+                    limit_per_host=32,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=60
+                ),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+
+    def open(self) -> None:
+        """Vuelve a crear el pool de Supabase si se cerró en un apagado anterior del mismo proceso."""
+        if self.supabase.postgrest.session.is_closed:
+            _replace_postgrest_session(self.supabase)
+
+    async def close(self) -> None:
+        """Cierra la sesión HTTP compartida y el pool de conexiones de Supabase."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self.supabase.postgrest.session.close()
         
-    async def create_conversation_with_message(self, data: ConversationWithFirstMessage) -> Optional[Dict]:
+    async def create_conversation_with_message(
+        self,
+        data: ConversationWithFirstMessage,
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> Optional[Dict]:
         """
         Crea una nueva conversación y el primer mensaje en la misma.
         
         Args:
             data (ConversationWithFirstMessage): Datos de la conversación y primer mensaje
+            background_tasks (BackgroundTasks, opcional): Tareas en segundo plano de la
+                petición, usadas para guardar la respuesta del LLM tras responder
             
         Returns:
             Dict: Datos de la conversación creada con el mensaje, o None si falla
@@ -33,7 +103,7 @@ class ChatHelper:
         try:
             # Crear ID único para la conversación
             conversation_id = str(uuid.uuid4())
-            current_time = datetime.now().isoformat()
+            current_time = _utc_now_iso()
             
             # Preparar datos de la conversación
             conversation_data = {
@@ -44,13 +114,6 @@ class ChatHelper:
                 "updated_at": current_time
             }
             
-            # Crear la conversación en Supabase
-            result = self.supabase.table("conversations").insert(conversation_data).execute()
-            
-            if not result.data:
-                logger.error("Error al crear la conversación")
-                return None
-            
             # Preparar datos del mensaje
             message_id = str(uuid.uuid4())
             message_data = {
@@ -61,17 +124,37 @@ class ChatHelper:
                 "created_at": current_time
             }
             
-            # Crear el mensaje en Supabase
-            message_result = self.supabase.table("messages").insert(message_data).execute()
+            # Crear la conversación y el mensaje en una única llamada a Supabase.
+            # La función SQL se ejecuta en una transacción, así que si falla la
+            # inserción del mensaje no queda una conversación huérfana.
+            # La escritura se lanza en paralelo con la llamada al LLM a través de
+            # n8n; return_exceptions=True evita que un error oculte al otro.
+            insert_result, llm_response = await asyncio.gather(
+                asyncio.to_thread(
+                    lambda: self.supabase.rpc(
+                        "create_conversation_with_message",
+                        {"p_conv": conversation_data, "p_msg": message_data}
+                    ).execute()
+                ),
+                self._process_message_with_llm(data.message_content, conversation_id),
+                return_exceptions=True
+            )
+            
+            if isinstance(llm_response, BaseException):
+                logger.error("Error al procesar mensaje con LLM: %s", llm_response)
+                llm_response = None
             
-            if not message_result.data:
-                # Si falla la creación del mensaje, intentar eliminar la conversación
-                self.supabase.table("conversations").delete().eq("id", conversation_id).execute()
-                logger.error("Error al crear el mensaje inicial")
+            # Sin la conversación guardada no se devuelve nada ni se programa
+            # la inserción de la respuesta del asistente
+            if isinstance(insert_result, BaseException):
+                logger.error("Error al crear conversación con mensaje: %s", insert_result)
+                return None
+            
+            # La función devuelve la conversación creada; sin filas no se guardó nada
+            if not insert_result.data:
+                logger.error("La conversación %s no se guardó", conversation_id)
                 return None
             
-            # Procesar el mensaje con el LLM a través de n8n
-            llm_response = await self._process_message_with_llm(data.message_content, conversation_id)
             if llm_response:
                 # Guardar la respuesta del LLM como un nuevo mensaje
                 llm_message_id = str(uuid.uuid4())
@@ -80,11 +163,12 @@ class ChatHelper:
                     "conversation_id": conversation_id,
                     "content": llm_response,
                     "role": "assistant",  # La respuesta siempre es del asistente
-                    "created_at": datetime.now().isoformat()
+                    # Timestamp propio para que la respuesta se ordene tras el mensaje del usuario
+                    "created_at": _utc_now_iso()
                 }
                 
                 # Crear el mensaje de respuesta en Supabase
-                self.supabase.table("messages").insert(llm_message_data).execute()
+                await self._save_assistant_message(llm_message_data, background_tasks)
                 
                 # Devolver los datos combinados
                 return {
@@ -100,10 +184,16 @@ class ChatHelper:
             }
             
         except Exception as e:
-            logger.error(f"Error al crear conversación con mensaje: {str(e)}")
+            logger.error("Error al crear conversación con mensaje: %s", e)
             return None
             
-    async def add_message_to_conversation(self, conversation_id: str, message: MessageCreate, user_id: str) -> Optional[Dict]:
+    async def add_message_to_conversation(
+        self,
+        conversation_id: str,
+        message: MessageCreate,
+        user_id: str,
+        background_tasks: Optional[BackgroundTasks] = None
+    ) -> Optional[Dict]:
         """
         Añade un mensaje a una conversación existente.
         
@@ -111,21 +201,21 @@ class ChatHelper:
             conversation_id (str): ID de la conversación
             message (MessageCreate): Datos del mensaje a crear
             user_id (str): ID del usuario que envía el mensaje
+            background_tasks (BackgroundTasks, opcional): Tareas en segundo plano de la
+                petición, usadas para guardar la respuesta del LLM tras responder
             
         Returns:
             Dict: Datos del mensaje creado y la respuesta del LLM, o None si falla
+            
+        Raises:
+            ConversationNotFoundError: Si la conversación no existe o no pertenece al usuario
         """
         try:
-            # Verificar que la conversación existe
-            conversation = self.supabase.table("conversations").select("*").eq("id", conversation_id).execute()
+            # Un único timestamp para el mensaje y la actualización de la conversación
+            current_time = _utc_now_iso()
             
-            if not conversation.data:
-                logger.error(f"Conversación {conversation_id} no encontrada")
-                return None
-                
             # Preparar datos del mensaje
             message_id = str(uuid.uuid4())
-            current_time = datetime.now().isoformat()
             
             message_data = {
                 "id": message_id,
@@ -135,20 +225,26 @@ class ChatHelper:
                 "created_at": current_time
             }
             
-            # Crear el mensaje en Supabase
-            result = self.supabase.table("messages").insert(message_data).execute()
+            # Verificar la propiedad de la conversación, crear el mensaje y actualizar
+            # el timestamp de la conversación en una única llamada a Supabase.
+            # Debe completarse antes de llamar al LLM para no procesar mensajes
+            # en conversaciones ajenas.
+            result = await asyncio.to_thread(
+                lambda: self.supabase.rpc(
+                    "add_message_to_owned_conversation",
+                    {"p_msg": message_data, "p_user_id": user_id}
+                ).execute()
+            )
             
+            # La función devuelve el mensaje insertado, o ninguna fila si la
+            # conversación no existe o no pertenece al usuario
             if not result.data:
-                logger.error("Error al crear el mensaje")
-                return None
-                
-            # Actualizar el timestamp de la conversación
-            self.supabase.table("conversations").update(
-                {"updated_at": current_time}
-            ).eq("id", conversation_id).execute()
+                logger.error("Conversación %s no encontrada", conversation_id)
+                raise ConversationNotFoundError(conversation_id)
             
             # Procesar el mensaje con el LLM a través de n8n
             llm_response = await self._process_message_with_llm(message.content, conversation_id)
+            
             if llm_response:
                 # Guardar la respuesta del LLM como un nuevo mensaje
                 llm_message_id = str(uuid.uuid4())
@@ -157,11 +253,12 @@ class ChatHelper:
                     "conversation_id": conversation_id,
                     "content": llm_response,
                     "role": "assistant",  # La respuesta siempre es del asistente
-                    "created_at": datetime.now().isoformat()
+                    # Timestamp propio para que la respuesta se ordene tras el mensaje del usuario
+                    "created_at": _utc_now_iso()
                 }
                 
                 # Crear el mensaje de respuesta en Supabase
-                self.supabase.table("messages").insert(llm_message_data).execute()
+                await self._save_assistant_message(llm_message_data, background_tasks)
                 
                 # Devolver tanto el mensaje del usuario como la respuesta del LLM
                 return {
@@ -171,10 +268,26 @@ class ChatHelper:
             
             return message_data
             
+        except ConversationNotFoundError:
+            raise
         except Exception as e:
-            logger.error(f"Error al añadir mensaje a conversación: {str(e)}")
+            logger.error("Error al añadir mensaje a conversación: %s", e)
             return None
     
+    def _insert_assistant_message(self, message_data: Dict) -> None:
+        """Inserta la respuesta del asistente. Pensado para ejecutarse en segundo plano."""
+        try:
+            self.supabase.table("messages").insert(message_data).execute()
+        except Exception as e:
+            logger.error("Error al guardar la respuesta del asistente: %s", e)
+    
+    async def _save_assistant_message(self, message_data: Dict, background_tasks: Optional[BackgroundTasks]) -> None:
+        """Programa la inserción de la respuesta del asistente después de responder, si es posible."""
+        if background_tasks is not None:
+            background_tasks.add_task(self._insert_assistant_message, message_data)
+        else:
+            await asyncio.to_thread(self._insert_assistant_message, message_data)
+    
     async def _process_message_with_llm(self, user_message: str, conversation_id: str) -> Optional[str]:
         """
         Procesa el mensaje del usuario con el LLM a través de n8n.
@@ -196,41 +309,107 @@ class ChatHelper:
                 "id": conversation_id
             }
             
-            # Realizar la llamada al webhook
-            async with aiohttp.ClientSession() as session:
-                async with session.post(webhook_url, json=payload) as response:
-                    if response.status == 200:
-                        response_data = await response.json()
-                        logger.info(f"Respuesta de n8n recibida: {response_data}")
-                        
-                        # Extraer la respuesta del LLM del resultado
-                        if isinstance(response_data, dict) and "message" in response_data:
-                            # Nuevo formato {'message': '...'}
-                            return response_data["message"]
-                        else:
-                            logger.warning(f"Formato de respuesta inesperado: {response_data}")
-                            return str(response_data)
+            # Realizar la llamada al webhook reutilizando la sesión compartida
+            session = await self._get_session()
+            async with session.post(webhook_url, json=payload) as response:
+                if response.status == 200:
+                    response_data = orjson.loads(await response.read())
+                    logger.info("Respuesta de n8n recibida: %s", response_data)
+                    
+                    # Extraer la respuesta del LLM del resultado
+                    if isinstance(response_data, dict) and "message" in response_data:
+                        # Nuevo formato {'message': '...'}
+                        return response_data["message"]
                     else:
-                        logger.error(f"Error al llamar al webhook de n8n: {response.status}")
-                        return None
+                        logger.warning("Formato de respuesta inesperado: %s", response_data)
+                        return str(response_data)
+                else:
+                    logger.error("Error al llamar al webhook de n8n: %s", response.status)
+                    return None
+        except Exception as e:
+            logger.error("Error al procesar mensaje con LLM: %s", e)
+            return None
+            
+    async def conversation_belongs_to_user(self, conversation_id: str, user_id: str) -> bool:
+        """Comprueba si una conversación existe y pertenece al usuario indicado."""
+        try:
+            result = await asyncio.to_thread(
+                lambda: self.supabase.table("conversations").select("id").eq("id", conversation_id).eq("user_id", user_id).limit(1).execute()
+            )
+            return bool(result.data)
+        except Exception as e:
+            logger.error("Error al verificar la propiedad de la conversación: %s", e)
+            return False
+            
+    async def get_messages_if_owned(self, conversation_id: str, user_id: str) -> List[Dict]:
+        """
+        Obtiene los mensajes de una conversación solo si pertenece al usuario,
+        comprobando la propiedad en la misma consulta mediante un join.
+        
+        Returns:
+            List[Dict]: Mensajes ordenados por fecha, o una lista vacía si la
+            conversación no existe, no pertenece al usuario o no tiene mensajes
+        """
+        try:
+            result = await asyncio.to_thread(
+                lambda: self.supabase.table("messages").select(
+                    "*, conversations!inner(user_id)"
+                ).eq("conversation_id", conversation_id).eq(
+                    "conversations.user_id", user_id
+                ).order("created_at").execute()
+            )
         except Exception as e:
-            logger.error(f"Error al procesar mensaje con LLM: {str(e)}")
+            logger.error("Error al obtener mensajes de la conversación: %s", e)
+            return []
+        
+        # Quitar la columna embebida usada solo para filtrar
+        for row in result.data or []:
+            row.pop("conversations", None)
+        return result.data or []
+            
+    async def get_messages_version(self, conversation_id: str, user_id: str) -> Optional[Tuple[int, str]]:
+        """
+        Obtiene con una consulta mínima el número de mensajes y la fecha del último
+        de una conversación del usuario, para validar cachés HTTP sin leer los mensajes.
+        
+        Returns:
+            Tuple[int, str]: (número de mensajes, created_at del último), o None si la
+            conversación no tiene mensajes, no pertenece al usuario o hay un error
+        """
+        try:
+            result = await asyncio.to_thread(
+                lambda: self.supabase.table("messages").select(
+                    "created_at, conversations!inner(user_id)", count="exact"
+                ).eq("conversation_id", conversation_id).eq(
+                    "conversations.user_id", user_id
+                ).order("created_at", desc=True).limit(1).execute()
+            )
+        except Exception as e:
+            logger.error("Error al obtener la versión de los mensajes: %s", e)
+            return None
+        
+        if not result.data or not result.count:
             return None
+        return result.count, result.data[0]["created_at"]
             
     async def get_conversations_by_user(self, user_id: str) -> List[Dict]:
         """Obtiene todas las conversaciones de un usuario."""
         try:
-            result = self.supabase.table("conversations").select("*").eq("user_id", user_id).execute()
+            result = await asyncio.to_thread(
+                lambda: self.supabase.table("conversations").select("*").eq("user_id", user_id).execute()
+            )
             return result.data or []
         except Exception as e:
-            logger.error(f"Error al obtener conversaciones del usuario: {str(e)}")
+            logger.error("Error al obtener conversaciones del usuario: %s", e)
             return []
             
     async def get_messages_by_conversation(self, conversation_id: str) -> List[Dict]:
         """Obtiene todos los mensajes de una conversación específica."""
         try:
-            result = self.supabase.table("messages").select("*").eq("conversation_id", conversation_id).order("created_at").execute()
+            result = await asyncio.to_thread(
+                lambda: self.supabase.table("messages").select("*").eq("conversation_id", conversation_id).order("created_at").execute()
+            )
             return result.data or []
         except Exception as e:
-            logger.error(f"Error al obtener mensajes de la conversación: {str(e)}")
+            logger.error("Error al obtener mensajes de la conversación: %s", e)
             return []
\ No newline at end of file
@@ -1,53 +1,148 @@
 from typing import Optional, Dict, Any, List
+from cachetools import TTLCache
+import hashlib
 import httpx
 import os
+import time
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
-from jose import JWTError, jwt
+from functools import cached_property
+import asyncio
+import bcrypt
+import jwt
+import orjson
+from jwt import InvalidTokenError as JWTError
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 import logging
+from pydantic import TypeAdapter
 from app.models.user import UserBase, UserCreate, UserLogin, Token
 from app.interfaces.user_repository import UserRepositoryInterface
 from app.interfaces.auth_service import AuthServiceInterface
 
 logger = logging.getLogger(__name__)
 
+# Límites de las cachés de autenticación
+TOKEN_CACHE_MAX_SIZE = 10_000
+TOKEN_CACHE_TTL_SECONDS = 30
+USER_CACHE_MAX_SIZE = 5_000
+USER_CACHE_TTL_SECONDS = 60
+# Margen (en segundos) antes de la expiración del token en el que deja de usarse la caché
+AUTH_CACHE_EXPIRY_MARGIN_SECONDS = 5
+
+# Columnas de la tabla users que se solicitan a Supabase; el hash de la
+# contraseña solo se pide en el flujo de login
+USER_COLUMNS = "id,username,email,hashed_password"
+PUBLIC_USER_COLUMNS = "id,username,email"
+
+# Validador compilado una sola vez para listas de usuarios
+_USER_LIST_ADAPTER = TypeAdapter(List[UserBase])
+
+# Coste de bcrypt por defecto para los hashes nuevos
+DEFAULT_BCRYPT_ROUNDS = 12
+
+def _quote_filter_value(value: str) -> str:
+    """Escapa un valor para usarlo dentro de un filtro `or` de PostgREST."""
+    escaped = value.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
 class UsersHelper(UserRepositoryInterface, AuthServiceInterface):
-    def __init__(self, supabase_url=None, supabase_key=None, jwt_secret=None, algorithm="HS256", access_token_expire_minutes=60*24):
+    def __init__(self, supabase_url=None, supabase_key=None, jwt_secret=None, algorithm="HS256", access_token_expire_minutes=60*24, bcrypt_rounds=None):
         # Permitir inicialización desde variables de entorno o parámetros
         self.SUPABASE_URL = supabase_url or os.getenv("SUPABASE_URL")
         self.SUPABASE_KEY = supabase_key or os.getenv("SUPABASE_KEY") 
         self.JWT_SECRET = jwt_secret or os.getenv("JWT_SECRET")
         self.ALGORITHM = algorithm
         self.ACCESS_TOKEN_EXPIRE_MINUTES = access_token_expire_minutes
+        self.BCRYPT_ROUNDS = bcrypt_rounds or int(os.getenv("BCRYPT_ROUNDS", DEFAULT_BCRYPT_ROUNDS))
         
-        # Configuración para el hash de contraseñas
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        # Clave, algoritmos y opciones JWT (se construyen una sola vez)
+        self._jwt_key = self.JWT_SECRET.encode() if self.JWT_SECRET else None
+        self._jwt_algorithms = (self.ALGORITHM,)
+        self._jwt_options = {"verify_signature": True, "verify_exp": True, "require": ["exp", "sub"]}
         
         # OAuth2 para la autenticación
         self.oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
         
+        # Cabeceras de Supabase, constantes durante la vida del helper
+        self._auth_headers = {
+            "apikey": self.SUPABASE_KEY or "",
+            "Authorization": f"Bearer {self.SUPABASE_KEY}"
+        }
+        # Las cabeceras de autenticación ya van en el cliente y httpx añade
+        # Content-Type al enviar json=; las escrituras solo necesitan Prefer
+        self._write_headers = {"Prefer": "return=representation"}
+        
+        # Cliente HTTP compartido con pool de conexiones hacia Supabase
+        self._http = self._create_http_client()
+        
+        # Cachés de autenticación: hash del token -> payload y username -> usuario
+        self._token_cache: TTLCache = TTLCache(maxsize=TOKEN_CACHE_MAX_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+        self._user_cache: TTLCache = TTLCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+        
+    def _create_http_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.SUPABASE_URL or "",
+            headers=self._auth_headers,
+            http2=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30.0),
+            timeout=10.0
+        )
+    
+    def open(self) -> None:
+        """Vuelve a crear el cliente HTTP si se cerró en un apagado anterior del mismo proceso."""
+        if self._http.is_closed:
+            self._http = self._create_http_client()
+        
     # Funciones de utilidad para autenticación
+    @cached_property
+    def _dummy_password_hash(self) -> str:
+        # Hash ficticio con el que se compara la contraseña cuando el usuario no
+        # existe; usa el mismo coste que los hashes reales para que el tiempo de
+        # respuesta no revele si el usuario existe. Se calcula en el primer uso
+        # para no pagar un bcrypt completo al crear el helper
+        return bcrypt.hashpw(b"dummy-password", bcrypt.gensalt(rounds=self.BCRYPT_ROUNDS)).decode()
+    
     def verify_password(self, plain_password, hashed_password):
-        return self.pwd_context.verify(plain_password, hashed_password)
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
     def get_password_hash(self, password):
-        return self.pwd_context.hash(password)
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=self.BCRYPT_ROUNDS)).decode()
+
+    # Caché de autenticación
+    @staticmethod
+    def _token_cache_key(token: str) -> bytes:
+        # Se guarda un hash para no mantener los tokens en memoria
+        return hashlib.sha256(token.encode()).digest()[:16]
+
+    def _decode_token(self, token: str) -> Optional[dict]:
+        """Decodifica y valida un token, reutilizando el resultado si ya se verificó."""
+        key = self._token_cache_key(token)
+        payload = self._token_cache.get(key)
+        if payload is not None:
+            if time.time() < payload["exp"] - AUTH_CACHE_EXPIRY_MARGIN_SECONDS:
+                return payload
+            self._token_cache.pop(key, None)
+        
+        try:
+            payload = jwt.decode(token, self._jwt_key, algorithms=self._jwt_algorithms, options=self._jwt_options)
+        except JWTError:
+            return None
+        
+        self._token_cache[key] = payload
+        return payload
 
     # Implementaciones de AuthServiceInterface
     async def authenticate_user(self, user_data: UserLogin) -> Optional[UserBase]:
-        # Intentamos autenticar primero por username y luego por email si está disponible
-        user = await self.get_user_by_username(user_data.username)
-        
-        if not user and user_data.email:
-            user = await self.get_user_by_email(user_data.email)
+        user = await self.get_user_with_password(user_data.username, user_data.email)
         
         if not user:
+            # Comparación con un hash ficticio para mantener el tiempo constante
+            # (el hash ficticio se genera en el hilo la primera vez)
+            await asyncio.to_thread(lambda: self.verify_password(user_data.password, self._dummy_password_hash))
             return None
             
-        # Verificar la contraseña
-        if not self.verify_password(user_data.password, user.hashed_password):
+        # Verificar la contraseña (bcrypt es costoso en CPU: se ejecuta en un hilo)
+        if not await asyncio.to_thread(self.verify_password, user_data.password, user.hashed_password):
             return None
             
         return user
@@ -62,76 +157,89 @@ class UsersHelper(UserRepositoryInterface, AuthServiceInterface):
             expire = datetime.utcnow() + timedelta(minutes=self.ACCESS_TOKEN_EXPIRE_MINUTES)
         
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, self.JWT_SECRET, algorithm=self.ALGORITHM)
+        encoded_jwt = jwt.encode(to_encode, self._jwt_key, algorithm=self.ALGORITHM)
         
         return Token(access_token=encoded_jwt, token_type="bearer", user_id=user_id)
         
     async def verify_token(self, token: str) -> Optional[dict]:
-        try:
-            payload = jwt.decode(token, self.JWT_SECRET, algorithms=[self.ALGORITHM])
-            return payload
-        except JWTError:
-            return None
+        return self._decode_token(token)
     
     # Implementaciones de UserRepositoryInterface
     async def get_user_by_id(self, user_id: int) -> Optional[UserBase]:
-        headers = {
-            "apikey": self.SUPABASE_KEY,
-            "Authorization": f"Bearer {self.SUPABASE_KEY}"
-        }
+        response = await self._http.get(
+            "/rest/v1/users",
+            params={"id": f"eq.{user_id}", "select": PUBLIC_USER_COLUMNS, "limit": 1}
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.SUPABASE_URL}/rest/v1/users?id=eq.{user_id}&select=*",
-                headers=headers
-            )
-            
-            if response.status_code == 200 and response.json():
-                return UserBase(**response.json()[0])
-            return None
+        if response.status_code == 200:
+            rows = orjson.loads(response.content)
+            if rows:
+                return UserBase.model_construct(**rows[0])
+        return None
             
     async def get_user_by_email(self, email: str) -> Optional[UserBase]:
-        headers = {
-            "apikey": self.SUPABASE_KEY,
-            "Authorization": f"Bearer {self.SUPABASE_KEY}"
-        }
+        response = await self._http.get(
+            "/rest/v1/users",
+            params={"email": f"eq.{email}", "select": PUBLIC_USER_COLUMNS, "limit": 1}
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.SUPABASE_URL}/rest/v1/users?email=eq.{email}&select=*",
-                headers=headers
-            )
-            
-            if response.status_code == 200 and response.json():
-                return UserBase(**response.json()[0])
-            return None
+        if response.status_code == 200:
+            rows = orjson.loads(response.content)
+            if rows:
+                return UserBase.model_construct(**rows[0])
+        return None
 
     # Mantener compatibilidad con código existente
     async def get_user_by_username(self, username: str) -> Optional[UserBase]:
-        headers = {
-            "apikey": self.SUPABASE_KEY,
-            "Authorization": f"Bearer {self.SUPABASE_KEY}"
-        }
+        response = await self._http.get(
+            "/rest/v1/users",
+            params={"username": f"eq.{username}", "select": PUBLIC_USER_COLUMNS, "limit": 1}
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.SUPABASE_URL}/rest/v1/users?username=eq.{username}&select=*",
-                headers=headers
-            )
-            
-            if response.status_code == 200 and response.json():
-                return UserBase(**response.json()[0])
-            return None
+        if response.status_code == 200:
+            rows = orjson.loads(response.content)
+            if rows:
+                return UserBase.model_construct(**rows[0])
+        return None
 
-    async def create_user(self, user: UserCreate) -> UserBase:
-        headers = {
-            "apikey": self.SUPABASE_KEY,
-            "Authorization": f"Bearer {self.SUPABASE_KEY}",
-            "Content-Type": "application/json",
-            "Prefer": "return=representation"
-        }
+    async def username_exists(self, username: str) -> bool:
+        """Comprueba si el nombre de usuario ya está registrado pidiendo solo el id."""
+        response = await self._http.get(
+            "/rest/v1/users",
+            params={"username": f"eq.{username}", "select": "id", "limit": 1}
+        )
         
-        hashed_password = self.get_password_hash(user.password)
+        if response.status_code == 200:
+            return bool(orjson.loads(response.content))
+        return False
+
+    async def get_user_with_password(self, username: str, email: Optional[str] = None) -> Optional[UserBase]:
+        """
+        Obtiene un usuario por username o email incluyendo el hash de su contraseña.
+        Solo debe usarse en el flujo de login; el resto de consultas lo omiten.
+        """
+        # Buscamos por username o email en una única consulta
+        quoted_username = _quote_filter_value(username)
+        quoted_email = _quote_filter_value(email or username)
+        
+        response = await self._http.get(
+            "/rest/v1/users",
+            params={
+                "or": f"(username.eq.{quoted_username},email.eq.{quoted_email})",
+                "select": USER_COLUMNS,
+                "limit": 1
+            }
+        )
+        
+        if response.status_code == 200:
+            rows = orjson.loads(response.content)
+            if rows:
+                return UserBase.model_construct(**rows[0])
+        return None
+
+    async def create_user(self, user: UserCreate) -> UserBase:
+        # El hash es costoso en CPU: se calcula en un hilo para no bloquear el event loop
+        hashed_password = await asyncio.to_thread(self.get_password_hash, user.password)
         
         user_data = {
             "username": user.username,
@@ -139,65 +247,57 @@ class UsersHelper(UserRepositoryInterface, AuthServiceInterface):
             "hashed_password": hashed_password
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.SUPABASE_URL}/rest/v1/users",
-                json=user_data,
-                headers=headers
-            )
-            
-            if response.status_code == 201:
-                return UserBase(**response.json()[0])
-            return None
+        response = await self._http.post(
+            "/rest/v1/users",
+            json=user_data,
+            headers=self._write_headers
+        )
+        
+        if response.status_code == 201:
+            return UserBase.model_validate(orjson.loads(response.content)[0])
+        return None
     
-    async def get_users(self, skip: int = 0, limit: int = 100) -> List[UserBase]:
-        headers = {
-            "apikey": self.SUPABASE_KEY,
-            "Authorization": f"Bearer {self.SUPABASE_KEY}"
-        }
+    async def get_users(self, skip: int = 0, limit: int = 100, select: str = PUBLIC_USER_COLUMNS) -> List[UserBase]:
+        response = await self._http.get(
+            "/rest/v1/users",
+            params={"select": select, "offset": skip, "limit": limit}
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.SUPABASE_URL}/rest/v1/users?select=*&offset={skip}&limit={limit}",
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                return [UserBase(**user) for user in response.json()]
-            return []
+        if response.status_code == 200:
+            return _USER_LIST_ADAPTER.validate_python(orjson.loads(response.content))
+        return []
             
     async def update_user(self, user_id: int, user_data: dict) -> Optional[UserBase]:
-        headers = {
-            "apikey": self.SUPABASE_KEY,
-            "Authorization": f"Bearer {self.SUPABASE_KEY}",
-            "Content-Type": "application/json",
-            "Prefer": "return=representation"
-        }
+        response = await self._http.patch(
+            "/rest/v1/users",
+            params={"id": f"eq.{user_id}"},
+            json=user_data,
+            headers=self._write_headers
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.patch(
-                f"{self.SUPABASE_URL}/rest/v1/users?id=eq.{user_id}",
-                json=user_data,
-                headers=headers
-            )
-            
-            if response.status_code == 200 and response.json():
-                return UserBase(**response.json()[0])
-            return None
+        # Los datos cacheados de los usuarios dejan de ser válidos
+        self._user_cache.clear()
+        
+        if response.status_code == 200:
+            rows = orjson.loads(response.content)
+            if rows:
+                return UserBase.model_validate(rows[0])
+        return None
             
     async def delete_user(self, user_id: int) -> bool:
-        headers = {
-            "apikey": self.SUPABASE_KEY,
-            "Authorization": f"Bearer {self.SUPABASE_KEY}"
-        }
+        response = await self._http.delete(
+            "/rest/v1/users",
+            params={"id": f"eq.{user_id}"}
+        )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{self.SUPABASE_URL}/rest/v1/users?id=eq.{user_id}",
-                headers=headers
-            )
-            
-            return response.status_code == 204
+        # El usuario eliminado no debe seguir resolviéndose desde la caché
+        self._user_cache.clear()
+        
+        return response.status_code == 204
+
+    async def aclose(self) -> None:
+        """Cierra el cliente HTTP compartido."""
+        await self._http.aclose()
     
     # Dependencia para obtener el usuario actual
     async def get_current_user(self, token: str = Depends(OAuth2PasswordBearer(tokenUrl="login"))):
@@ -207,15 +307,18 @@ class UsersHelper(UserRepositoryInterface, AuthServiceInterface):
             headers={"WWW-Authenticate": "Bearer"},
         )
         
-        try:
-            payload = jwt.decode(token, self.JWT_SECRET, algorithms=[self.ALGORITHM])
-            username: str = payload.get("sub")
-            if username is None:
-                raise credentials_exception
-        except JWTError:
+        payload = self._decode_token(token)
+        if payload is None:
             raise credentials_exception
         
-        user = await self.get_user_by_username(username)
-        if user is None:
+        username: str = payload.get("sub")
+        if username is None:
             raise credentials_exception
+        
+        user = self._user_cache.get(username)
+        if user is None:
+            user = await self.get_user_by_username(username)
+            if user is None:
+                raise credentials_exception
+            self._user_cache[username] = user
         return user
\ No newline at end of file
@@ -1,7 +1,21 @@
 # Este archivo hace que la carpeta interfaces sea reconocida como un paquete Python
 # Aquí exportaremos las interfaces para facilitar su importación desde otros módulos
+# Las interfaces se importan bajo demanda (PEP 562)
 
-from app.interfaces.user_repository import UserRepositoryInterface
-from app.interfaces.auth_service import AuthServiceInterface
+_LAZY = {
+    "UserRepositoryInterface": "app.interfaces.user_repository",
+    "AuthServiceInterface": "app.interfaces.auth_service"
+}
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return list(globals()) + list(_LAZY)
 
 __all__ = ["UserRepositoryInterface", "AuthServiceInterface"]
\ No newline at end of file
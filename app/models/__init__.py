@@ -1,5 +1,23 @@
 # Este archivo hace que la carpeta models sea reconocida como un paquete Python
-from app.models.user import UserBase, UserCreate, UserLogin, Token
+# Los modelos se importan bajo demanda (PEP 562)
+
+_LAZY = {
+    "UserBase": "app.models.user",
+    "UserCreate": "app.models.user",
+    "UserLogin": "app.models.user",
+    "Token": "app.models.user"
+}
+
+def __getattr__(name):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return list(globals()) + list(_LAZY)
 
 # Exportar los modelos relevantes
 __all__ = ["UserBase", "UserCreate", "UserLogin", "Token"]
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from datetime import datetime
 from typing import Optional, List, Literal
 
@@ -14,8 +14,8 @@ class Message(MessageBase):
     conversation_id: str
     created_at: datetime
     
-    class Config:
-        from_attributes = True  # Para permitir la conversión desde objetos ORM
+    # from_attributes permite la conversión desde objetos ORM
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 class ConversationBase(BaseModel):
     title: Optional[str] = None
@@ -29,8 +29,8 @@ class Conversation(ConversationBase):
     updated_at: datetime
     user_id: str
     
-    class Config:
-        from_attributes = True  # Para permitir la conversión desde objetos ORM
+    # from_attributes permite la conversión desde objetos ORM
+    model_config = ConfigDict(from_attributes=True, extra="ignore")
 
 class ConversationWithFirstMessage(BaseModel):
     title: Optional[str] = None
@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 from typing import Optional
 
 # Modelos Pydantic
 class UserBase(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     id: Optional[str] = None
     username: str
     email: str
@@ -1,16 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import Dict, List, Any
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, status
+from fastapi.responses import ORJSONResponse
+from typing import Dict, Any, Optional
+import hashlib
+import orjson
 
-from app.helpers.chat_helper import ChatHelper
-from app.helpers.users_helper import UsersHelper
+from app.helpers.chat_helper import ChatHelper, ConversationNotFoundError
+from app import get_users_helper
 from app.models.chat import MessageCreate, ConversationWithFirstMessage
 from app.models.user import UserBase
-from app.core.config import settings
+from app.core.config import get_settings
 
 # Configurar el logger
 import logging
 logger = logging.getLogger(__name__)
 
+settings = get_settings()
+
 # Crear instancia del helper de chat
 chat_helper = ChatHelper(
     supabase_url=settings.SUPABASE_URL,
@@ -18,12 +23,24 @@ chat_helper = ChatHelper(
 )
 
 # Crear instancia del helper de usuarios para la autenticación
-users_helper = UsersHelper(
-    supabase_url=settings.SUPABASE_URL,
-    supabase_key=settings.SUPABASE_KEY,
-    jwt_secret=settings.JWT_SECRET,
-    access_token_expire_minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
-)
+users_helper = get_users_helper()
+
+def _messages_etag(conversation_id: str, count: int, last_created_at: str) -> str:
+    """
+    ETag débil de la lista de mensajes: los mensajes solo se añaden, así que el
+    número de mensajes y la fecha del último identifican su contenido. Es débil
+    porque GZipMiddleware puede cambiar la representación enviada.
+    """
+    version = f"{conversation_id}:{count}:{last_created_at}".encode()
+    return f'W/"{hashlib.blake2b(version, digest_size=16).hexdigest()}"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comprueba si la cabecera If-None-Match incluye el ETag indicado (comparación débil)."""
+    if not if_none_match:
+        return False
+    opaque_tag = etag.removeprefix("W/")
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or opaque_tag in candidates
 
 router = APIRouter(
     prefix="/chat",
@@ -33,6 +50,7 @@ router = APIRouter(
 @router.post("/conversations", status_code=status.HTTP_201_CREATED, response_model=Dict[str, Any])
 async def create_conversation_with_first_message(
     data: ConversationWithFirstMessage,
+    background_tasks: BackgroundTasks,
     current_user: UserBase = Depends(users_helper.get_current_user)
 ):
     """
@@ -40,6 +58,7 @@ async def create_conversation_with_first_message(
     
     Args:
         data: Datos de la conversación y primer mensaje
+        background_tasks: Tareas que se ejecutan después de enviar la respuesta
         current_user: Usuario autenticado obtenido del token
     
     Returns:
@@ -49,7 +68,7 @@ async def create_conversation_with_first_message(
     data.user_id = str(current_user.id)
     
     # Creamos la conversación con el mensaje
-    result = await chat_helper.create_conversation_with_message(data)
+    result = await chat_helper.create_conversation_with_message(data, background_tasks)
     
     if not result:
         raise HTTPException(
@@ -63,6 +82,7 @@ async def create_conversation_with_first_message(
 async def add_message_to_conversation(
     conversation_id: str, 
     message: MessageCreate,
+    background_tasks: BackgroundTasks,
     current_user: UserBase = Depends(users_helper.get_current_user)
 ):
     """
@@ -71,6 +91,7 @@ async def add_message_to_conversation(
     Args:
         conversation_id: ID de la conversación
         message: Datos del mensaje a crear
+        background_tasks: Tareas que se ejecutan después de enviar la respuesta
         current_user: Usuario autenticado obtenido del token
     
     Returns:
@@ -79,23 +100,18 @@ async def add_message_to_conversation(
     # Aseguramos que el rol sea "user" ya que el mensaje proviene del usuario
     message.role = "user"
     
-    # Verificar que la conversación existe y que el usuario es el propietario
-    conversations = await chat_helper.get_conversations_by_user(str(current_user.id))
-    conversation_exists = False
-    
-    for conv in conversations:
-        if conv.get("id") == conversation_id:
-            conversation_exists = True
-            break
-            
-    if not conversation_exists:
+    # El helper verifica en la misma llamada que la conversación existe
+    # y que el usuario es el propietario
+    try:
+        result = await chat_helper.add_message_to_conversation(
+            conversation_id, message, str(current_user.id), background_tasks
+        )
+    except ConversationNotFoundError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Conversación no encontrada o no tienes permiso para acceder a ella"
         )
     
-    result = await chat_helper.add_message_to_conversation(conversation_id, message, str(current_user.id))
-    
     if not result:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -105,7 +121,7 @@ async def add_message_to_conversation(
     return result
 
 # Nuevo endpoint para obtener todas las conversaciones de un usuario por su ID
-@router.get("/user/{user_id}/conversations", response_model=List[Dict[str, Any]])
+@router.get("/user/{user_id}/conversations")
 async def get_conversations_by_user_id(
     user_id: str,
     current_user: UserBase = Depends(users_helper.get_current_user)
@@ -124,35 +140,51 @@ async def get_conversations_by_user_id(
     # para ver estas conversaciones (es el mismo usuario o un administrador)
     
     conversations = await chat_helper.get_conversations_by_user(user_id)
-    return conversations
+    # Se serializa directamente: las filas de Supabase ya son JSON válido
+    return ORJSONResponse(conversations)
 
 # Nuevo endpoint para obtener todos los mensajes de una conversación por su ID
-@router.get("/conversations/{conversation_id}/messages", response_model=List[Dict[str, Any]])
+@router.get("/conversations/{conversation_id}/messages")
 async def get_messages_by_conversation_id(
     conversation_id: str,
+    request: Request,
     current_user: UserBase = Depends(users_helper.get_current_user)
 ):
     """
     Obtiene todos los mensajes de una conversación específica por su ID.
     
+    La respuesta incluye un ETag; si el cliente envía el mismo valor en
+    If-None-Match se responde 304 sin cuerpo y sin leer los mensajes.
+    
     Args:
         conversation_id: ID de la conversación
+        request: Petición HTTP, para leer la cabecera If-None-Match
         current_user: Usuario autenticado obtenido del token (para verificación)
     
     Returns:
         Lista de mensajes de la conversación especificada
     """
-    # Por seguridad, verificamos que la conversación pertenece al usuario
-    # o que el usuario tiene permisos para verla
-    conversations = await chat_helper.get_conversations_by_user(str(current_user.id))
-    conversation_exists = False
-    
-    for conv in conversations:
-        if conv.get("id") == conversation_id:
-            conversation_exists = True
-            break
-            
-    if not conversation_exists:
+    user_id = str(current_user.id)
+    if_none_match = request.headers.get("if-none-match")
+    headers = {"Cache-Control": "private, no-cache"}
+    
+    # En una petición condicional se compara primero con una consulta mínima
+    # (número de mensajes y fecha del último, filtrando por propietario), de
+    # modo que si nada ha cambiado no se leen ni se serializan los mensajes
+    if if_none_match:
+        version = await chat_helper.get_messages_version(conversation_id, user_id)
+        if version is not None:
+            etag = _messages_etag(conversation_id, *version)
+            if _etag_matches(if_none_match, etag):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={**headers, "ETag": etag})
+    
+    # Por seguridad, solo se devuelven mensajes si la conversación pertenece
+    # al usuario; la comprobación se hace en la misma consulta
+    messages = await chat_helper.get_messages_if_owned(conversation_id, user_id)
+    
+    # Una lista vacía puede ser una conversación ajena o simplemente sin mensajes;
+    # solo en ese caso se hace la comprobación de propiedad por separado
+    if not messages and not await chat_helper.conversation_belongs_to_user(conversation_id, user_id):
         # Si quieres permitir acceso a administradores, aquí podrías
         # verificar si el usuario tiene ese rol
         raise HTTPException(
@@ -160,5 +192,10 @@ async def get_messages_by_conversation_id(
             detail="Conversación no encontrada o no tienes permiso para acceder a ella"
         )
     
-    messages = await chat_helper.get_messages_by_conversation(conversation_id)
-    return messages
\ No newline at end of file
+    # Los mensajes vienen ordenados por fecha: el último da la misma versión
+    # que calcula get_messages_version
+    if messages:
+        headers["ETag"] = _messages_etag(conversation_id, len(messages), messages[-1]["created_at"])
+    
+    # Se serializa directamente: las filas de Supabase ya son JSON válido
+    return Response(content=orjson.dumps(messages), media_type="application/json", headers=headers)
\ No newline at end of file
@@ -1,4 +1,11 @@
 # Gunicorn configuration file
-bind = "0.0.0.0:10000"
-workers = 4
+import multiprocessing
+import os
+
+# El Procfile usa este archivo: se respeta el PORT de la plataforma si existe
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+# Un worker por núcleo salvo que se indique WEB_CONCURRENCY
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# UvicornWorker selecciona uvloop y httptools automáticamente cuando están
+# instalados (incluidos en uvicorn[standard])
 worker_class = "uvicorn.workers.UvicornWorker"
@@ -1,19 +1,40 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 import logging
 
 # Importar desde nuestra nueva estructura
-from app.core.config import settings
+from app.core.config import get_settings
+from app import get_users_helper
 from app.routers import auth_router, chat_router
+from app.routers.chat import chat_helper
 
 # Configurar el logging
 logger = logging.getLogger(__name__)
 
+settings = get_settings()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los helpers son únicos por proceso: si un arranque anterior cerró sus
+    # pools de conexiones (p. ej. varios TestClient seguidos), se recrean aquí
+    users_helper = get_users_helper()
+    chat_helper.open()
+    users_helper.open()
+    yield
+    # Cerrar los pools de conexiones HTTP compartidos por todas las peticiones
+    await chat_helper.close()
+    await users_helper.aclose()
+
 # Inicializar la aplicación FastAPI
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description=settings.PROJECT_DESCRIPTION,
-    version=settings.PROJECT_VERSION
+    version=settings.PROJECT_VERSION,
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configurar CORS
@@ -25,6 +46,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Comprimir respuestas grandes (listas de conversaciones y mensajes)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Incluir routers
 app.include_router(auth_router, prefix="/api")
 app.include_router(chat_router, prefix="/api")
@@ -35,5 +59,20 @@ async def root():
 
 # Iniciar el servidor
 if __name__ == "__main__":
+    import os
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    
+    if os.getenv("ENVIRONMENT", "development") == "production":
+        # Un proceso por núcleo; reload no es compatible con varios workers
+        uvicorn.run(
+            "main:app",
+            host="0.0.0.0",
+            port=int(os.getenv("PORT", "8000")),
+            workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+            loop="uvloop",
+            http="httptools",
+            log_level="warning"
+        )
+    else:
+        # loop="auto" usa uvloop si está instalado (no existe en Windows)
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, loop="auto", http="httptools")
\ No newline at end of file
@@ -0,0 +1,15 @@
+-- Crea una conversación y su primer mensaje en una sola transacción
+create or replace function public.create_conversation_with_message(p_conv jsonb, p_msg jsonb)
+returns void
+language plpgsql
+as $$
+begin
+    insert into public.conversations (id, title, user_id, created_at, updated_at)
+    select id, title, user_id, created_at, updated_at
+    from jsonb_populate_record(null::public.conversations, p_conv);
+
+    insert into public.messages (id, conversation_id, content, role, created_at)
+    select id, conversation_id, content, role, created_at
+    from jsonb_populate_record(null::public.messages, p_msg);
+end;
+$$;
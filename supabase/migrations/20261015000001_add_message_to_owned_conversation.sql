@@ -0,0 +1,28 @@
+-- Añade un mensaje a una conversación solo si pertenece al usuario indicado,
+-- actualizando su updated_at en la misma transacción.
+-- Devuelve el mensaje insertado, o ninguna fila si la conversación no existe
+-- o es de otro usuario (PostgREST responde siempre con una lista de filas).
+create or replace function public.add_message_to_owned_conversation(p_msg jsonb, p_user_id text)
+returns setof public.messages
+language plpgsql
+as $$
+declare
+    m public.messages;
+begin
+    m := jsonb_populate_record(null::public.messages, p_msg);
+
+    update public.conversations
+    set updated_at = m.created_at
+    where id = m.conversation_id
+      and user_id::text = p_user_id;
+
+    if not found then
+        return;
+    end if;
+
+    return query
+    insert into public.messages (id, conversation_id, content, role, created_at)
+    values (m.id, m.conversation_id, m.content, m.role, m.created_at)
+    returning *;
+end;
+$$;
@@ -0,0 +1,25 @@
+-- create_conversation_with_message devolvía void: PostgREST responde con un
+-- cuerpo vacío o null y postgrest-py no distingue el éxito de "nada insertado".
+-- Ahora devuelve la conversación creada, igual que add_message_to_owned_conversation
+-- devuelve el mensaje insertado.
+drop function if exists public.create_conversation_with_message(jsonb, jsonb);
+
+create function public.create_conversation_with_message(p_conv jsonb, p_msg jsonb)
+returns setof public.conversations
+language plpgsql
+as $$
+declare
+    c public.conversations;
+begin
+    insert into public.conversations (id, title, user_id, created_at, updated_at)
+    select id, title, user_id, created_at, updated_at
+    from jsonb_populate_record(null::public.conversations, p_conv)
+    returning * into c;
+
+    insert into public.messages (id, conversation_id, content, role, created_at)
+    select id, conversation_id, content, role, created_at
+    from jsonb_populate_record(null::public.messages, p_msg);
+
+    return next c;
+end;
+$$;
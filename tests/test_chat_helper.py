@@ -0,0 +1,118 @@
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from fastapi import BackgroundTasks
+from postgrest.utils import SyncClient
+
+from app.helpers.chat_helper import ChatHelper, ConversationNotFoundError
+from app.models.chat import ConversationWithFirstMessage, MessageCreate
+
+SUPABASE_URL = "https://test.supabase.co"
+# Clave con forma de JWT para pasar la validación de supabase.create_client
+SUPABASE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.firma"
+
+
+class ChatHelperRpcTestCase(unittest.IsolatedAsyncioTestCase):
+    """Recorre las llamadas RPC a través de postgrest-py contra un PostgREST simulado."""
+
+    def setUp(self):
+        self.helper = ChatHelper(SUPABASE_URL, SUPABASE_KEY)
+        self.requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return httpx.Response(200, json=self.rpc_rows(json.loads(request.content)))
+
+        postgrest = self.helper.supabase.postgrest
+        self._original_session = postgrest.session
+        postgrest.session = SyncClient(
+            base_url=self._original_session.base_url,
+            headers=self._original_session.headers,
+            transport=httpx.MockTransport(handler)
+        )
+        # Sin llamadas reales al webhook del LLM
+        patcher = patch.object(self.helper, "_process_message_with_llm", AsyncMock(return_value=None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.helper.supabase.postgrest.session.aclose()
+        self.helper.supabase.postgrest.session = self._original_session
+
+    def rpc_rows(self, params: dict) -> list:
+        """Filas que devuelve la función SQL simulada para los parámetros recibidos."""
+        raise NotImplementedError
+
+
+class AddMessageToConversationTest(ChatHelperRpcTestCase):
+    def setUp(self):
+        super().setUp()
+        # Por defecto, como la función SQL, devuelve la fila del mensaje insertado
+        self.conversation_owned = True
+
+    def rpc_rows(self, params: dict) -> list:
+        return [params["p_msg"]] if self.conversation_owned else []
+
+    async def test_returns_message_when_conversation_is_owned(self):
+        message = await self.helper.add_message_to_conversation(
+            "c1", MessageCreate(content="hola", role="user"), "u1"
+        )
+
+        self.assertEqual(message["conversation_id"], "c1")
+        self.assertEqual(message["content"], "hola")
+        request = self.requests[-1]
+        self.assertEqual(request.url.path, "/rest/v1/rpc/add_message_to_owned_conversation")
+        self.assertEqual(json.loads(request.content)["p_user_id"], "u1")
+
+    async def test_raises_not_found_when_conversation_is_not_owned(self):
+        self.conversation_owned = False
+
+        with self.assertRaises(ConversationNotFoundError):
+            await self.helper.add_message_to_conversation(
+                "ajena", MessageCreate(content="hola", role="user"), "u1"
+            )
+        self.helper._process_message_with_llm.assert_not_awaited()
+
+
+class CreateConversationWithMessageTest(ChatHelperRpcTestCase):
+    def setUp(self):
+        super().setUp()
+        # Por defecto, como la función SQL, devuelve la fila de la conversación creada
+        self.conversation_saved = True
+        self.helper._process_message_with_llm.return_value = "respuesta"
+
+    def rpc_rows(self, params: dict) -> list:
+        return [params["p_conv"]] if self.conversation_saved else []
+
+    async def test_returns_conversation_and_schedules_reply(self):
+        background_tasks = BackgroundTasks()
+
+        result = await self.helper.create_conversation_with_message(
+            ConversationWithFirstMessage(title="t", message_content="hola", user_id="u1"),
+            background_tasks
+        )
+
+        conversation_id = result["conversation"]["id"]
+        self.assertEqual(result["user_message"]["conversation_id"], conversation_id)
+        self.assertEqual(result["llm_response"]["content"], "respuesta")
+        self.assertEqual(len(background_tasks.tasks), 1)
+        request = self.requests[-1]
+        self.assertEqual(request.url.path, "/rest/v1/rpc/create_conversation_with_message")
+
+    async def test_returns_none_when_conversation_is_not_saved(self):
+        self.conversation_saved = False
+        background_tasks = BackgroundTasks()
+
+        result = await self.helper.create_conversation_with_message(
+            ConversationWithFirstMessage(title="t", message_content="hola", user_id="u1"),
+            background_tasks
+        )
+
+        self.assertIsNone(result)
+        self.assertEqual(background_tasks.tasks, [])
+
+
+if __name__ == "__main__":
+    unittest.main()